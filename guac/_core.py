@@ -0,0 +1,86 @@
+from .monad import _LIFT, _detach, _preserve, _specialize
+
+# Hot loops that setup.py compiles with Cython when it's available. The
+# extension module shadows this file, which otherwise runs as plain Python.
+
+_END = object()
+
+def run_list(monad, computation):
+    """
+    Runs a computation in the list monad.
+
+    Rather than binding each yielded list to a continuation, which nests
+    a call per yield, the branches are explored depth-first with an
+    explicit stack and the result of each finished branch is appended in
+    order.
+
+    Arguments:
+    monad -- the list monad running the computation
+    computation -- the monadic function applied to its arguments
+    """
+    (resume, terminal, fork) = (computation.resume, computation.terminal, computation.fork)
+    evaluate = _specialize(monad)
+    results = []
+
+    # Each frame holds the trace leading to a yield that binds more than
+    # one value, an iterator over the values left after the next one, the
+    # next value itself, and a fork of the invocation taken before its
+    # first branch resumed it, if it could be copied, so later branches
+    # needn't replay the trace. The first branch resumes the invocation
+    # itself, and the last resumes the fork rather than copying it again.
+    stack = []
+    (invocation, monadic_value) = computation.begin()
+    trace = ()
+    while True:
+        # Follow the current branch. Binding a single value doesn't branch,
+        # so such yields are resumed straight away rather than pushed as a
+        # frame, and lifted values never need a list built for them.
+        while True:
+            if type(monadic_value) is tuple and monadic_value and monadic_value[0] is _LIFT:
+                x = monadic_value[1]
+                if terminal(invocation):
+                    results.append(x)
+                    break
+            else:
+                if type(monadic_value) is tuple and monadic_value:
+                    monadic_value = evaluate(monadic_value)
+                if terminal(invocation):
+                    # Nothing follows this yield, so don't resume or replay.
+                    results.extend(monadic_value)
+                    break
+                values = iter(_detach(monadic_value))
+                x = next(values, _END)
+                if x is _END:
+                    break
+                following = next(values, _END)
+                if following is not _END:
+                    stack.append((trace, values, following, fork(invocation)))
+            sent = _preserve(x)
+            (done, monadic_value) = resume(invocation, x)
+            if done:
+                if monadic_value:
+                    raise ValueError("unexpected return value in monadic function")
+                results.append(x)
+                break
+            trace += (sent,)
+
+        # Backtrack to the most recent yield with values left to bind.
+        while stack:
+            (trace, values, x, saved) = stack[-1]
+            following = next(values, _END)
+            if following is _END:
+                stack.pop()
+                invocation = saved if saved is not None else computation.replay(trace)
+            else:
+                stack[-1] = (trace, values, following, saved)
+                invocation = computation.restore(saved, trace)
+            sent = _preserve(x)
+            (done, monadic_value) = resume(invocation, x)
+            if not done:
+                trace += (sent,)
+                break
+            if monadic_value:
+                raise ValueError("unexpected return value in monadic function")
+            results.append(x)
+        else:
+            return results
@@ -0,0 +1,247 @@
+import ast, inspect, textwrap
+
+# Lowers a generator function into a class whose `step` method behaves
+# like `send` on the generator, but reports completion by returning a
+# `(done, value)` pair instead of raising `StopIteration`.
+#   - each yield becomes a numbered resume state
+#   - local variables become slots on the state machine
+#   - `step` dispatches on the current state in a `while True` ladder, so
+#     the code following an `if` that yields can be jumped to by `continue`
+#   - `_sm_terminal` holds the states of yields after which the body
+#     immediately finishes, so resuming there can be skipped entirely
+#   - `_sm_forkable` reports whether a suspended machine can be copied by
+#     copying its slots, which isn't so if the body creates a lambda or
+#     generator that reads locals, since it reads them through the original
+
+_SELF = '_sm_self'
+_SENT = '_sm_sent'
+_STATE = '_sm_state'
+
+# Match statements only exist from Python 3.10.
+_MATCH = getattr(ast, 'Match', ())
+
+_SCOPES = (ast.Lambda, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef,
+           ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+class LoweringError(Exception):
+    """Raised when a generator function cannot be lowered."""
+
+def lower(f):
+    """
+    Lowers a generator function into an equivalent state machine class.
+
+    Constructing the class with the function's arguments returns a state
+    machine. Calling `step(x)` on it sends `x` into the function body,
+    returning `(False, value)` for the next yielded value, or
+    `(True, value)` with the returned value once the body finishes.
+
+    Arguments:
+    f -- the generator function to lower
+    """
+    if f.__code__.co_freevars:
+        raise LoweringError('cannot lower a closure')
+    try:
+        source = textwrap.dedent(inspect.getsource(f))
+    except (OSError, TypeError) as e:
+        raise LoweringError('source unavailable') from e
+
+    module = ast.parse(source)
+    function = module.body[0]
+    if not isinstance(function, ast.FunctionDef):
+        raise LoweringError('expected a function definition')
+    ast.increment_lineno(module, f.__code__.co_firstlineno - 1)
+
+    local_names = _local_names(function)
+    forkable = not any(isinstance(node, (ast.Lambda, ast.GeneratorExp))
+                       and any(isinstance(inner, ast.Name) and inner.id in local_names
+                               for inner in ast.walk(node))
+                       for node in ast.walk(function))
+    body = function.body
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+            and isinstance(body[0].value.value, str):
+        body = body[1:] # docstring
+    body = [_Localizer(local_names).visit(statement) for statement in body]
+    body = _replace_returns(body)
+
+    lowering = _Lowering()
+    lowering.blocks.append(None)
+    lowering.blocks[0] = lowering.lower(body, lambda: _finish(None), True)
+
+    ladder = [ast.Return(_result(True, None))]
+    for (state, block) in reversed(list(enumerate(lowering.blocks))):
+        test = ast.Compare(_attribute(_STATE, ast.Load()), [ast.Eq()], [ast.Constant(state)])
+        ladder = [ast.If(test, block, ladder)]
+    step = ast.FunctionDef(
+        name='step',
+        args=_arguments([ast.arg(_SELF), ast.arg(_SENT)]),
+        body=[ast.While(ast.Constant(True), ladder, [])],
+        decorator_list=[])
+
+    parameters = function.args
+    for parameter in _parameters(parameters):
+        parameter.annotation = None
+    parameters.defaults = [ast.Constant(None) for _ in parameters.defaults]
+    parameters.kw_defaults = [None if default is None else ast.Constant(None)
+                              for default in parameters.kw_defaults]
+    if parameters.posonlyargs:
+        parameters.posonlyargs.insert(0, ast.arg(_SELF))
+    else:
+        parameters.args.insert(0, ast.arg(_SELF))
+    init = ast.FunctionDef(
+        name='__init__',
+        args=parameters,
+        body=[ast.Assign([_attribute(p.arg, ast.Store())], ast.Name(p.arg, ast.Load()))
+              for p in _parameters(parameters)[1:]] + _goto(0),
+        decorator_list=[])
+
+    slots = ast.Assign([ast.Name('__slots__', ast.Store())],
+                       ast.Tuple([ast.Constant(name) for name in sorted(local_names)] + [ast.Constant(_STATE)],
+                                 ast.Load()))
+    machine = ast.ClassDef(name=function.name, bases=[], keywords=[], body=[slots, init, step],
+                           decorator_list=[])
+    module = ast.Module(body=[ast.copy_location(machine, function)], type_ignores=[])
+    ast.fix_missing_locations(module)
+    namespace = {}
+    exec(compile(module, f.__code__.co_filename, 'exec'), f.__globals__, namespace)
+
+    cls = namespace[function.name]
+    cls.__init__.__defaults__ = f.__defaults__
+    cls.__init__.__kwdefaults__ = f.__kwdefaults__
+    cls.__module__ = f.__module__
+    cls.__qualname__ = f.__qualname__
+    cls.__doc__ = f.__doc__
+    cls._sm_terminal = frozenset(lowering.terminal)
+    cls._sm_forkable = forkable
+    return cls
+
+class _Lowering:
+    def __init__(self):
+        self.blocks = []
+        self.terminal = set()
+
+    def lower(self, statements, exit, finishes):
+        lowered = []
+        for (i, statement) in enumerate(statements):
+            if not _contains_yield(statement):
+                lowered.append(statement)
+                continue
+            rest = statements[i + 1:]
+            if _is_yield_statement(statement):
+                resume = len(self.blocks)
+                self.blocks.append(None)
+                if isinstance(statement, ast.Assign):
+                    received = [ast.Assign(statement.targets, ast.Name(_SENT, ast.Load()))]
+                else:
+                    received = []
+                value = statement.value.value
+                self.blocks[resume] = received + self.lower(rest, exit, finishes)
+                if not rest and finishes:
+                    self.terminal.add(resume)
+                return lowered + _goto(resume) + [ast.Return(_result(False, value))]
+            if isinstance(statement, ast.If) and not _contains_yield(statement.test):
+                if rest:
+                    join = len(self.blocks)
+                    self.blocks.append(None)
+                    self.blocks[join] = self.lower(rest, exit, finishes)
+                    (branch_exit, branch_finishes) = (lambda: _goto(join) + [ast.Continue()], False)
+                else:
+                    (branch_exit, branch_finishes) = (exit, finishes)
+                statement.body = self.lower(statement.body, branch_exit, branch_finishes)
+                statement.orelse = self.lower(statement.orelse, branch_exit, branch_finishes)
+                return lowered + [statement]
+            raise LoweringError('cannot lower a yield within {}'.format(type(statement).__name__))
+        return lowered + exit()
+
+class _Localizer(ast.NodeTransformer):
+    def __init__(self, local_names):
+        self.local_names = local_names
+
+    def visit_Name(self, node):
+        if node.id in self.local_names:
+            return ast.copy_location(_attribute(node.id, node.ctx), node)
+        return node
+
+class _ReturnReplacer(ast.NodeTransformer):
+    def visit_Return(self, node):
+        return [ast.copy_location(statement, node) for statement in _finish(node.value)]
+
+    def generic_visit(self, node):
+        if isinstance(node, _SCOPES):
+            return node
+        return super().generic_visit(node)
+
+def _replace_returns(statements):
+    replaced = []
+    for statement in statements:
+        statement = _ReturnReplacer().visit(statement)
+        replaced += statement if isinstance(statement, list) else [statement]
+    return replaced
+
+def _local_names(function):
+    parameters = function.args
+    names = {p.arg for p in _parameters(parameters)}
+    for node in _walk_scope(function):
+        if isinstance(node, (ast.Global, ast.Nonlocal, ast.Import, ast.ImportFrom, _MATCH,
+                             ast.NamedExpr, ast.YieldFrom, ast.Await, ast.FunctionDef,
+                             ast.AsyncFunctionDef, ast.ClassDef)):
+            raise LoweringError('cannot lower {}'.format(type(node).__name__))
+        if isinstance(node, ast.ExceptHandler) and node.name is not None:
+            raise LoweringError('cannot lower a named exception handler')
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+
+    # Nested scopes read locals through the state machine, so they must not
+    # bind any names of their own that would shadow them.
+    for node in _walk_scope(function):
+        if isinstance(node, _SCOPES):
+            for inner in ast.walk(node):
+                if isinstance(inner, ast.arg) and inner.arg in names \
+                        or isinstance(inner, ast.Name) and not isinstance(inner.ctx, ast.Load) \
+                        and inner.id in names:
+                    raise LoweringError('cannot lower a nested scope shadowing a local')
+
+    if any(name.startswith('_sm_') for name in names):
+        raise LoweringError('cannot lower locals prefixed with _sm_')
+    return names
+
+def _parameters(parameters):
+    return (parameters.posonlyargs + parameters.args
+            + ([parameters.vararg] if parameters.vararg else [])
+            + parameters.kwonlyargs
+            + ([parameters.kwarg] if parameters.kwarg else []))
+
+def _walk_scope(node):
+    for child in ast.iter_child_nodes(node):
+        yield child
+        if not isinstance(child, _SCOPES):
+            yield from _walk_scope(child)
+
+def _contains_yield(node):
+    return isinstance(node, ast.Yield) or any(isinstance(n, ast.Yield) for n in _walk_scope(node))
+
+def _is_yield_statement(statement):
+    if isinstance(statement, ast.Expr):
+        value = statement.value
+    elif isinstance(statement, ast.Assign):
+        value = statement.value
+        if any(_contains_yield(target) for target in statement.targets):
+            return False
+    else:
+        return False
+    return isinstance(value, ast.Yield) and (value.value is None or not _contains_yield(value.value))
+
+def _attribute(name, ctx):
+    return ast.Attribute(ast.Name(_SELF, ast.Load()), name, ctx)
+
+def _arguments(args):
+    return ast.arguments(posonlyargs=[], args=args, vararg=None, kwonlyargs=[],
+                         kw_defaults=[], kwarg=None, defaults=[])
+
+def _goto(state):
+    return [ast.Assign([_attribute(_STATE, ast.Store())], ast.Constant(state))]
+
+def _result(done, value):
+    return ast.Tuple([ast.Constant(done), value or ast.Constant(None)], ast.Load())
+
+def _finish(value):
+    return _goto(-1) + [ast.Return(_result(True, value))]
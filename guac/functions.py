@@ -1,6 +1,12 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from .monad import *
+from .monad import _LIFT, _EMPTY, _CONCAT, _MAP, _FILTER, _UNIT, _FAIL
+from .monad import _current_monad, _evaluate_builtin
 
-@monadic
+@monadic_sm
 def bind(m, f):
     """
     Unwraps the plain value from the monadic context and
@@ -13,7 +19,7 @@ def bind(m, f):
     
     yield f(m)
 
-@monadic
+@monadic_sm
 def lift(value):
     """
     Lifts a plain value into the monadic context.
@@ -22,9 +28,9 @@ def lift(value):
     x - the plain value to lift
     """
     
-    yield Monad._Builtin(lambda m: m.lift(value))
+    yield (_LIFT, value)
 
-@monadic
+@monadic_sm
 def empty():
     """
     Creates an empty monadic context.
@@ -33,9 +39,9 @@ def empty():
     by all monads.
     """
     
-    yield Monad._Builtin(lambda m: m.empty())
+    yield (_EMPTY,)
     
-@monadic
+@monadic_sm
 def concat(x, y):
     """
     Concatenates two monadic context.
@@ -44,47 +50,64 @@ def concat(x, y):
     by all monads.
     """
     
-    yield Monad._Builtin(lambda m: m.concat(x, y))
+    yield (_CONCAT, x, y)
 
-@monadic
-def unit():
+def unit(monad=None):
     """
     Lifts a unit value into the monadic context.
+    
+    Within a monadic function, this returns a shared operation that
+    is evaluated once yielded, rather than running a computation on
+    every call.
+    
+    Arguments:
+    monad -- an optional monad instance to evaluate the result in
     """
     
-    yield lift(())
+    return _builtin(_UNIT, monad)
 
-@monadic
-def guard(condition):
+def guard(condition, monad=None):
     """
     Guards against a condition within a monadic context, trimming
     branches where this condition does not hold.
     
-    Requires the monad to support `empty`.
+    Requires the monad to support `empty`. Within a monadic function,
+    this returns a shared operation that is evaluated once yielded,
+    rather than running a computation on every call.
     
     Argument:
     condition -- the condition that must hold
+    monad -- an optional monad instance to evaluate the result in
     """
     
-    if condition:
-        yield unit()
-    else:
-        yield empty()
+    return _builtin(_UNIT if condition else _FAIL, monad)
 
-@monadic
+def _builtin(operation, monad):
+    if monad is not None:
+        return _evaluate_builtin(monad, operation)
+    elif _current_monad.get(None) is None:
+        raise RuntimeError('unspecified monadic context')
+    return operation
+
+@monadic_sm
 def map(f, m):
     """
     Maps the transform over the plain value within the monadic context.
     
+    The transform is applied within a single bind, or directly by the
+    monad's `map` where it provides one.
+    
     Argument:
     f -- function that maps from plain value to plain value
     m -- the monadic value to be mapped over
     """
     
-    x = yield m
-    yield lift(f(x))
+    yield (_MAP, f, m)
+
+# Alias that doesn't shadow the builtin `map`.
+fmap = map
     
-@monadic
+@monadic_sm
 def join(m):
     """
     Flattens a layer of nesting of monadic context.
@@ -96,18 +119,48 @@ def join(m):
     x = yield m
     yield x
 
-@monadic
+@monadic_sm
 def filter(predicate, m):
     """
     Filters out values where the condition does not hold.
     
-    Requires the monad to support `empty`.
+    Requires the monad to support `empty`. The predicate is applied
+    within a single bind, or directly by the monad's `filter` where it
+    provides one.
     
     Argument:
     predicate -- a bool-returning function over plain values
     m -- the monadic value to filter
     """
     
-    x = yield m
-    guard(pred(x))
-    yield x
+    yield (_FILTER, predicate, m)
+
+# Alias that doesn't shadow the builtin `filter`.
+ffilter = filter
+
+def map_np(f, m):
+    """
+    Maps a vectorized transform over an array of plain values in
+    NumpyListMonad, calling it once on the whole array rather than
+    once per element.
+    
+    Argument:
+    f -- a vectorized function that maps from array to array
+    m -- the array to be mapped over
+    """
+    
+    return numpy.asarray(f(numpy.asarray(m)))
+
+def filter_np(predicate, m):
+    """
+    Filters out elements of an array of plain values in NumpyListMonad
+    where the condition does not hold, evaluating the condition once
+    on the whole array as a boolean mask.
+    
+    Argument:
+    predicate -- a vectorized function from array to boolean array
+    m -- the array to filter
+    """
+    
+    m = numpy.asarray(m)
+    return m[numpy.asarray(predicate(m), dtype=bool)]
@@ -1,4 +1,11 @@
+import itertools
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from .monad import *
+from .monad import _current_monad, _specialize
+from ._core import run_list
 
 class ListMonad(Monad):
     """
@@ -27,10 +34,49 @@ class ListMonad(Monad):
         f -- a function from list element to list
         """
         
-        result = []
-        for elem in m:
-            result += f(elem)
-        return result
+        if type(m) is list and len(m) == 1:
+            return f(m[0])
+        return list(itertools.chain.from_iterable(map(f, m)))
+    
+    @staticmethod
+    def map(m, f):
+        """
+        Maps the transform over each element of a list.
+        
+        Arguments:
+        m -- the list to map over
+        f -- a function from list element to list element
+        """
+        
+        return [f(elem) for elem in m]
+    
+    @staticmethod
+    def filter(m, predicate):
+        """
+        Filters out the elements of a list where the predicate
+        does not hold.
+        
+        Arguments:
+        m -- the list to filter
+        predicate -- a bool-returning function over list elements
+        """
+        
+        return [elem for elem in m if predicate(elem)]
+    
+    @classmethod
+    def _run(self, computation):
+        """
+        Runs the computation depth-first in a loop rather than through
+        nested binds. The loop is compiled by Cython where available.
+        
+        Subclasses that override `bind` fall back to the generic runner.
+        
+        Arguments:
+        computation -- the monadic function applied to its arguments
+        """
+        if self.bind is not ListMonad.bind:
+            return super()._run(computation)
+        return run_list(self, computation)
         
     @staticmethod
     def empty():
@@ -52,6 +98,134 @@ class ListMonad(Monad):
         
         return x + y
 
+class NumpyListMonad(Monad):
+    """
+    Monad instance for non-deterministic computation
+    using NumPy arrays.
+    
+    Numeric results are kept in contiguous arrays, so they can be
+    transformed and filtered as a whole by `map_np` and `filter_np`.
+    Requires NumPy.
+    """
+    
+    @staticmethod
+    def lift(x):
+        """
+        Lifts a value into a singleton array.
+        
+        Non-scalar values are stored in an array of objects.
+        
+        Arguments:
+        x -- the plain value to lift
+        """
+        
+        if numpy.isscalar(x):
+            return numpy.array([x])
+        result = numpy.empty(1, dtype=object)
+        result[0] = x
+        return result
+    
+    @staticmethod
+    def bind(m, f):
+        """
+        Performs a flat-map operation over an array.
+        
+        Arguments:
+        m -- the array to map over
+        f -- a function from array element to array
+        """
+        
+        # Skip empty results so they don't change the dtype of the rest.
+        parts = [part for part in map(f, m) if len(part)]
+        if not parts:
+            return NumpyListMonad.empty()
+        elif len(parts) == 1:
+            return numpy.asarray(parts[0])
+        return _concatenate(parts)
+        
+    @staticmethod
+    def empty():
+        """
+        Constructs an empty array.
+        """
+        
+        return numpy.array([])
+        
+    @staticmethod
+    def concat(x, y):
+        """
+        Concatenates two arrays.
+        
+        Arguments:
+        x -- the array to order first
+        y -- the array to order second
+        """
+        
+        if not len(x):
+            return numpy.asarray(y)
+        elif not len(y):
+            return numpy.asarray(x)
+        return _concatenate((x, y))
+
+def _concatenate(parts):
+    # Concatenating arrays of different dtypes would coerce their values,
+    # e.g. ints to strings, so those are kept as objects instead.
+    parts = [numpy.asarray(part) for part in parts]
+    if any(part.dtype != parts[0].dtype for part in parts):
+        parts = [part.astype(object) for part in parts]
+    return numpy.concatenate(parts)
+
+class IdentityMonad(Monad):
+    """
+    Monad instance for plain computation without any effects.
+    """
+    
+    @staticmethod
+    def lift(x):
+        """
+        Does nothing.
+        
+        Arguments:
+        x -- the value to return
+        """
+        
+        return x
+    
+    @staticmethod
+    def bind(m, f):
+        """
+        Performs the operation on the value.
+        
+        Arguments:
+        m -- the value to operate on
+        f -- the transform
+        """
+        
+        return f(m)
+    
+    @classmethod
+    def _run(self, computation):
+        """
+        Runs the computation by sending each yielded value straight
+        back into the invocation, since binding has no effect.
+        
+        Arguments:
+        computation -- the monadic function applied to its arguments
+        """
+        (resume, evaluate) = (computation.resume, _specialize(self))
+        (invocation, x) = computation.begin()
+        while True:
+            if type(x) is tuple and x:
+                x = evaluate(x)
+            if computation.terminal(invocation):
+                return x
+            (done, resumed) = resume(invocation, x)
+            if done:
+                if resumed:
+                    raise ValueError("unexpected return value in monadic function")
+                return x
+            x = resumed
+
 class NoneMonad(Monad):
     """
     Monad instance for failable computation using None.
@@ -104,7 +278,7 @@ class NoneMonad(Monad):
         x -- the first value
         y -- the second value
         """
-        return x or y
+        return x if x is not None else y
 
 class ExceptionMonad(Monad):
     """
@@ -136,10 +310,10 @@ class ExceptionMonad(Monad):
         f -- a transform that may return an Exception
         """
         
-        if m is not None:
+        if not isinstance(m, Exception):
             return f(m)
         else:
-            return None
+            return m
 
     @staticmethod
     def empty():
@@ -192,6 +366,20 @@ class FunctionMonad(Monad):
         f -- the transform function
         """
         return lambda x: f(m(x))(x)
+    
+    @classmethod
+    def _run(self, computation):
+        """
+        Runs the computation as a function that feeds its argument to
+        each yielded function in a loop rather than through nested binds.
+        
+        Arguments:
+        computation -- the monadic function applied to its arguments
+        """
+        def apply(m, x):
+            result = m(x)
+            return (result, result, x)
+        return _run_threaded(self, computation, apply)
 
 class StateMonad(Monad):
     """
@@ -223,4 +411,56 @@ class StateMonad(Monad):
             (x, new_state) = m(state)
             return f(x)(new_state)
         return thread_state
+    
+    @classmethod
+    def _run(self, computation):
+        """
+        Runs the computation as a stateful computation that threads the
+        state through each yielded one in a loop rather than through
+        nested binds.
+        
+        Arguments:
+        computation -- the monadic function applied to its arguments
+        """
+        def apply(m, state):
+            (x, state) = m(state)
+            return ((x, state), x, state)
+        return _run_threaded(self, computation, apply)
 
+def _run_threaded(monad, computation, apply):
+    """
+    Runs a computation whose monadic values are functions of some input,
+    returning a function of that input. The function resumes the
+    invocation in a loop rather than nesting a call per bind, so long
+    computations don't grow the stack.
+    
+    Arguments:
+    monad -- the monad running the computation
+    computation -- the monadic function applied to its arguments
+    apply -- a function applying a monadic value to the input, returning
+             the result, the plain value to send in, and the next input
+    """
+    evaluate = _specialize(monad)
+    (invocation, first) = computation.begin()
+    def run(value):
+        nonlocal invocation
+        token = _current_monad.set(monad)
+        try:
+            if invocation is None:
+                (resumed, m) = computation.begin()
+            else:
+                (resumed, m), invocation = (invocation, first), None
+            while True:
+                if type(m) is tuple and m:
+                    m = evaluate(m)
+                (result, x, value) = apply(m, value)
+                if computation.terminal(resumed):
+                    return result
+                (done, m) = computation.resume(resumed, x)
+                if done:
+                    if m:
+                        raise ValueError("unexpected return value in monadic function")
+                    return result
+        finally:
+            _current_monad.reset(token)
+    return run
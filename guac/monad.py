@@ -1,10 +1,14 @@
-import abc, copy, inspect
+import contextvars, copy, dis, functools, inspect, threading, types
+from . import _lowering
 
-class Monad(metaclass=abc.ABCMeta):  
-    """An abstract class whose subclasses represent monad instances."""
+class Monad:  
+    """
+    An abstract class whose subclasses represent monad instances.
+    
+    Monads are never instantiated; the class itself is the instance.
+    """
     
     @staticmethod    
-    @abc.abstractmethod
     def lift(x):
         """
         Lifts a plain value into the monadic context.
@@ -12,10 +16,9 @@ class Monad(metaclass=abc.ABCMeta):
         Arguments:
         x - the plain value to lift
         """
-        return NotImplemented
+        raise NotImplementedError
         
     @staticmethod
-    @abc.abstractmethod
     def bind(m, f):
         """
         Unwraps the plain value from the monadic context and
@@ -25,30 +28,278 @@ class Monad(metaclass=abc.ABCMeta):
         m -- the monadic value
         f -- the function from plain value to monadic value
         """
-        return NotImplemented
+        raise NotImplementedError
+    
+    @classmethod
+    def map(self, m, f):
+        """
+        Maps the transform over the plain value within the monadic
+        context.
+        
+        Monads may override this with a more direct implementation.
+        
+        Arguments:
+        m -- the monadic value
+        f -- the function from plain value to plain value
+        """
+        return self.bind(m, lambda x: self.lift(f(x)))
+    
+    @classmethod
+    def filter(self, m, predicate):
+        """
+        Filters out plain values within the monadic context where the
+        predicate does not hold.
+        
+        Requires the monad to support `empty`. Monads may override this
+        with a more direct implementation.
+        
+        Arguments:
+        m -- the monadic value
+        predicate -- the bool-returning function over plain values
+        """
+        return self.bind(m, lambda x: self.lift(x) if predicate(x) else self.empty())
         
-    class _Builtin:
-        def __init__(self, impl):
-            self.evaluate_in_monad = impl
-                
     @classmethod    
     def _run(self, computation):
-        def step(monadic_value, continuation):
-            if isinstance(monadic_value, Monad._Builtin):
-                monadic_value = monadic_value.evaluate_in_monad(self)
+        bind, lift, resume = self.bind, self.lift, computation.resume
+        evaluate = _specialize(self)
+        def step(monadic_value, invocation, trace):
+            if type(monadic_value) is tuple and monadic_value:
+                monadic_value = evaluate(monadic_value)
+            if computation.terminal(invocation):
+                # Nothing follows this yield, so don't resume or replay.
+                return bind(monadic_value, lift)
             def proceed(x):
-                invocation = copy.deepcopy(continuation) # Requires Pypy!
-                try:
-                    return step(invocation.send(x), invocation)
-                except StopIteration as e:
-                    if e.value:
+                nonlocal invocation
+                # Monads like StateMonad defer calling `proceed` until after
+                # `_run` returns, so restore the context for inherited lookups.
+                if _current_monad.get(None) is not self:
+                    token = _current_monad.set(self)
+                    try:
+                        return proceed(x)
+                    finally:
+                        _current_monad.reset(token)
+                # The first branch may resume the suspended invocation directly,
+                # but every later branch must replay the computation up to here.
+                if invocation is None:
+                    invocation = computation.replay(trace)
+                resumed, invocation = invocation, None
+                sent = _preserve(x)
+                (done, monadic_value) = resume(resumed, x)
+                if done:
+                    if monadic_value:
                         raise ValueError("unexpected return value in monadic function")
-                    return self.lift(x)
-            return self.bind(monadic_value, proceed)
-        try:
-            return step(next(computation), computation)
-        except StopIteration as e:
+                    return lift(x)
+                return step(monadic_value, resumed, trace + (sent,))
+            return bind(_detach(monadic_value), proceed)
+        (invocation, monadic_value) = computation.begin()
+        return step(monadic_value, invocation, ())
+
+# Builtin operations are yielded as tuples tagged with one of these
+# sentinels, and evaluated in whichever monad runs the computation.
+#   - (_LIFT, x)
+#   - (_EMPTY,)
+#   - (_CONCAT, x, y)
+#   - (_MAP, f, m)
+#   - (_FILTER, predicate, m)
+class _Operation:
+    __slots__ = ('name',)
+    
+    def __init__(self, name):
+        self.name = name
+        
+    def __repr__(self):
+        return '<guac {}>'.format(self.name)
+        
+    # Arguments are copied for every run, and the sentinels must keep
+    # their identity when they're passed as operands.
+    def __copy__(self):
+        return self
+        
+    def __deepcopy__(self, memo):
+        return self
+
+_LIFT, _EMPTY, _CONCAT = _Operation('lift'), _Operation('empty'), _Operation('concat')
+_MAP, _FILTER = _Operation('map'), _Operation('filter')
+
+# Operations shared by every caller, since they carry no arguments.
+_UNIT = (_LIFT, ())
+_FAIL = (_EMPTY,)
+
+def _evaluate_builtin(monad, monadic_value):
+    return _specialize(monad)(monadic_value)
+
+@functools.lru_cache(maxsize=None)
+def _specialize(monad):
+    """
+    Partially evaluates the builtin operations for a monad instance,
+    returning a function that evaluates an operation tuple in it.
+    
+    The monad's methods are looked up once, when the monad is first
+    run, rather than on every evaluation. Runners fetch the specialized
+    function once per run.
+    
+    Arguments:
+    monad -- the monad instance to specialize for
+    """
+    lift = monad.lift
+    empty = getattr(monad, 'empty', None) or _unsupported(monad, 'empty')
+    concat = getattr(monad, 'concat', None) or _unsupported(monad, 'concat')
+    map, filter = monad.map, monad.filter
+    def evaluate(monadic_value):
+        operation = monadic_value[0]
+        if operation is _LIFT:
+            return lift(monadic_value[1])
+        elif operation is _EMPTY:
+            return empty()
+        elif operation is _CONCAT:
+            return concat(operand(monadic_value[1]), operand(monadic_value[2]))
+        elif operation is _MAP:
+            return map(operand(monadic_value[2]), monadic_value[1])
+        elif operation is _FILTER:
+            return filter(operand(monadic_value[2]), monadic_value[1])
+        else:
+            return monadic_value
+    def operand(monadic_value):
+        # Operands may themselves be operations returned by `unit` or `guard`.
+        if type(monadic_value) is tuple and monadic_value:
+            return evaluate(monadic_value)
+        return monadic_value
+    return evaluate
+
+def _unsupported(monad, name):
+    def unsupported(*args):
+        raise AttributeError('{} does not support {}'.format(monad.__name__, name))
+    return unsupported
+
+class _Computation:
+    """
+    A monadic function applied to its arguments.
+    
+    Generators cannot be copied, so a computation that must resume
+    from the same yield more than once is instead re-run from the
+    start, sending in the values recorded along the current branch.
+    Each run receives its own copy of the arguments, and of the values
+    sent in, so that mutations remain local to the branch that made them.
+    Runners record a copy of each value in the trace before sending it,
+    since the branch it's sent into may mutate it.
+    
+    The function may return either a generator or a lowered state
+    machine, so invocations are advanced through `resume`, which
+    returns a `(done, value)` pair rather than raising `StopIteration`.
+    Likewise, `terminal` reports whether an invocation is suspended at a
+    yield after which it immediately finishes. Resuming from such a yield
+    would just return the value sent in, so the invocation need not be
+    recreated and replayed to do so. Finally, `fork` copies a suspended
+    invocation where possible, which is far cheaper than a replay, and
+    otherwise returns None.
+    """
+    
+    __slots__ = ('f', 'args', 'kwargs', 'resume', 'terminal', 'fork')
+    
+    def __init__(self, f, args, kwargs, resume, terminal, fork):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.resume = resume
+        self.terminal = terminal
+        self.fork = fork
+        
+    def start(self):
+        """
+        Invokes the monadic function, returning a fresh generator.
+        """
+        
+        memo = {}
+        args = _snapshot(self.args, memo)
+        kwargs = {name: _snapshot(value, memo) for (name, value) in self.kwargs.items()}
+        return self.f(*args, **kwargs)
+        
+    def begin(self):
+        """
+        Invokes the monadic function and advances it to its first yield,
+        returning the invocation along with the yielded monadic value.
+        """
+        
+        invocation = self.start()
+        (done, monadic_value) = self.resume(invocation, None)
+        if done:
             raise ValueError("monadic function must yield at least once")
+        return (invocation, monadic_value)
+        
+    def replay(self, trace):
+        """
+        Invokes the monadic function and advances it to the yield
+        reached by sending in each value of the trace.
+        
+        Arguments:
+        trace -- the values previously sent into the computation
+        """
+        
+        invocation = self.start()
+        self.resume(invocation, None)
+        memo = {}
+        for x in trace:
+            self.resume(invocation, _preserve(x, memo))
+        return invocation
+        
+    def restore(self, saved, trace):
+        """
+        Recreates an invocation suspended at the yield reached by the
+        trace, copying a saved fork of it if there is one and replaying
+        the trace otherwise.
+        
+        Arguments:
+        saved -- a fork of the suspended invocation, or None
+        trace -- the values previously sent into the computation
+        """
+        
+        if saved is not None:
+            return self.fork(saved)
+        return self.replay(trace)
+
+# Types whose values can't be mutated, so snapshots may share them.
+_IMMUTABLE = frozenset([type(None), bool, int, float, complex, str, bytes, range, type,
+                        types.FunctionType, types.BuiltinFunctionType, _Operation])
+
+def _snapshot(value, memo):
+    # Copies only what could be mutated, and containers of nothing but
+    # immutable values only shallowly. Copies share the memo, so values
+    # aliased between arguments or locals stay aliased.
+    cls = type(value)
+    if cls in _IMMUTABLE:
+        return value
+    elif cls is tuple:
+        copied = tuple(_snapshot(item, memo) for item in value)
+        return value if all(a is b for (a, b) in zip(copied, value)) else copied
+    elif cls is list or cls is set or cls is dict:
+        copied = memo.get(id(value))
+        if copied is not None:
+            return copied
+        types_held = set(map(type, value))
+        if cls is dict:
+            types_held.update(map(type, value.values()))
+        if types_held <= _IMMUTABLE:
+            copied = memo[id(value)] = value.copy()
+            return copied
+    return copy.deepcopy(value, memo)
+
+def _detach(monadic_value):
+    # Copies a yielded container before it's bound, since the first branch
+    # resumes the invocation that yielded it, which may mutate it while
+    # it's still being iterated.
+    cls = type(monadic_value)
+    if cls is list or cls is set or cls is dict or cls is bytearray:
+        return monadic_value.copy()
+    return monadic_value
+
+def _preserve(value, memo=None):
+    # Snapshots a value sent into a computation, or keeps the value itself
+    # if it can't be copied.
+    try:
+        return _snapshot(value, {} if memo is None else memo)
+    except Exception:
+        return value
 
 # + Decorator for executing a monad
 #   - an argument may be specified to specialize for a specific monad
@@ -89,21 +340,35 @@ def monadic(instance):
         yield lift(change)
     print(make_change(27, [1, 5, 10, 25]))
     """
-    def wrap(f, monad=None):
-        def monadic_context(*args, monad=monad, **kwargs):
-            if monad is None: #infer from context
-                for (frame, _, _, name, _, _) in inspect.stack()[1:]:
-                    if name == 'monadic_context':
-                        monad = inspect.getargvalues(frame).locals['monad']
-                        break
-                    del frame
-                else:
-                    raise RuntimeError('unspecified monadic context')
-            return monad._run(f(*args, **kwargs))
-        return monadic_context
-            
-    if issubclass(instance, Monad):
-        return lambda f: wrap(f, monad=instance)
+    if isinstance(instance, type) and issubclass(instance, Monad):
+        return lambda f: _wrap(f, monad=instance)
+    elif not callable(instance):
+        raise TypeError('expected instance of Monad')
+    
+    # We weren't given an instance; return an unspecialized wrapper.
+    f = instance
+    del instance
+        
+    if inspect.isgeneratorfunction(f):
+        return _wrap(f)
+    else:
+        raise ValueError('monadic function must be a generator')
+
+def monadic_sm(instance):
+    """
+    Decorates a monadic function so that invocation runs the monad,
+    lowering the generator into an explicit state machine first.
+    
+    The state machine is a plain object whose `step` method runs the
+    function body up to its next yield, so invocation avoids setting up
+    a generator. Only functions without yields inside loops, `try` or
+    `with` blocks can be lowered; others fall back to `monadic`.
+    
+    Arguments:
+    instance -- an optional argument specializing the monad instance
+    """
+    if isinstance(instance, type) and issubclass(instance, Monad):
+        return lambda f: _wrap_lowered(f, monad=instance)
     elif not callable(instance):
         raise TypeError('expected instance of Monad')
     
@@ -112,6 +377,149 @@ def monadic(instance):
     del instance
         
     if inspect.isgeneratorfunction(f):
-        return wrap(f)
+        return _wrap_lowered(f)
     else:
-        raise ValueError('monadic function must be a generator')        
+        raise ValueError('monadic function must be a generator')
+
+def memoized(f):
+    """
+    Marks a monadic function so that its results are memoized.
+    
+    Within a single outermost run, invoking the function again with equal
+    arguments in the same monad returns the earlier result rather than
+    running the computation again. This collapses the redundant re-runs of
+    shared subcomputations, such as recursive calls in a non-deterministic
+    search or the calls repeated when a branch is replayed.
+    
+    The function must be deterministic, its arguments must be hashable for
+    the result to be memoized, and the memoized monadic values are shared
+    between callers, so they must not be mutated.
+    
+    Usage:
+    Apply beneath the `monadic` decorator.
+    
+    Example:
+    @monadic(ListMonad)
+    @memoized
+    def fib(n):
+        if n < 2:
+            yield lift(n)
+        else:
+            x = yield fib(n - 1)
+            y = yield fib(n - 2)
+            yield lift(x + y)
+    """
+    f._guac_memoized = True
+    return f
+
+_memo = threading.local()
+
+# The monad of the innermost running monadic function, inherited by
+# unspecialized monadic functions that it invokes.
+_current_monad = contextvars.ContextVar('current_monad')
+
+def _run_memoized(monad, computation):
+    key = (computation.f, monad, computation.args, tuple(sorted(computation.kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return monad._run(computation)
+    
+    # The table lives only as long as the outermost memoized invocation,
+    # so results never outlive the run that computed them.
+    table = getattr(_memo, 'table', None)
+    outermost = table is None
+    if outermost:
+        table = _memo.table = {}
+    try:
+        if key in table:
+            return table[key]
+        result = table[key] = monad._run(computation)
+        return result
+    finally:
+        if outermost:
+            del _memo.table
+
+def _resume_generator(invocation, x):
+    try:
+        return (False, invocation.send(x))
+    except StopIteration as e:
+        return (True, e.value)
+
+def _generator_terminal(invocation):
+    return invocation.gi_frame.f_lasti in _terminal_yields(invocation.gi_code)
+
+@functools.lru_cache(maxsize=None)
+def _terminal_yields(code):
+    # Finds the yields followed only by instructions that discard the
+    # sent value and return None. A suspended generator's last instruction
+    # is the yield itself before Python 3.13, and the `RESUME` following it
+    # since, so the offsets of both are included.
+    instructions = list(dis.get_instructions(code))
+    terminal = set()
+    for (i, instruction) in enumerate(instructions):
+        if instruction.opname != 'YIELD_VALUE':
+            continue
+        for following in instructions[i + 1:]:
+            if following.opname in ('RESUME', 'NOP', 'CACHE', 'POP_TOP', 'STORE_FAST'):
+                continue
+            if following.opname == 'LOAD_CONST' and following.argval is None:
+                continue
+            if following.opname == 'RETURN_VALUE' \
+                    or following.opname == 'RETURN_CONST' and following.argval is None:
+                terminal.add(instruction.offset)
+                if instructions[i + 1].opname == 'RESUME':
+                    terminal.add(instructions[i + 1].offset)
+            break
+    return frozenset(terminal)
+
+def _machine_terminal(invocation):
+    return invocation._sm_state in invocation._sm_terminal
+
+def _fork_generator(invocation):
+    # CPython can't copy a suspended generator, so it must be replayed.
+    return None
+
+def _fork_machine(invocation):
+    cls = type(invocation)
+    if not cls._sm_forkable:
+        return None
+    fork = cls.__new__(cls)
+    memo = {}
+    for name in cls.__slots__:
+        try:
+            value = getattr(invocation, name)
+        except AttributeError: # local not yet bound
+            continue
+        try:
+            value = _snapshot(value, memo)
+        except Exception: # e.g. locks, files or generators, so replay instead
+            return None
+        setattr(fork, name, value)
+    return fork
+
+def _wrap(f, monad=None, resume=_resume_generator, terminal=_generator_terminal,
+          fork=_fork_generator, memoize=None):
+    if memoize is None:
+        memoize = getattr(f, '_guac_memoized', False)
+    def monadic_context(*args, monad=monad, **kwargs):
+        if monad is None: #infer from context
+            monad = _current_monad.get(None)
+            if monad is None:
+                raise RuntimeError('unspecified monadic context')
+        token = _current_monad.set(monad)
+        try:
+            if memoize:
+                return _run_memoized(monad, _Computation(f, args, kwargs, resume, terminal, fork))
+            return monad._run(_Computation(f, args, kwargs, resume, terminal, fork))
+        finally:
+            _current_monad.reset(token)
+    return monadic_context
+
+def _wrap_lowered(f, monad=None):
+    try:
+        machine = _lowering.lower(f)
+    except _lowering.LoweringError:
+        return _wrap(f, monad=monad)
+    return _wrap(machine, monad=monad, resume=machine.step, terminal=_machine_terminal,
+                 fork=_fork_machine, memoize=getattr(f, '_guac_memoized', False))
@@ -0,0 +1,70 @@
+import numba, numpy
+from .monad import monadic_sm
+from .instances import ListMonad, NumpyListMonad
+
+# Optional Numba acceleration for numeric non-deterministic search.
+#   - the monadic machinery itself can't be compiled, since Numba supports
+#     neither generator `send` nor arbitrary monad instances
+#   - instead, the plain-value work is compiled into ufuncs by `kernel`,
+#     and `monadic_numba` runs ListMonad searches over NumPy arrays so that
+#     `map_np` and `filter_np` apply those kernels to a whole branch at once
+
+def kernel(f):
+    """
+    Compiles a plain numeric function into a NumPy ufunc with Numba.
+
+    The resulting function runs at machine speed over whole arrays,
+    so pass it to `map_np` or `filter_np` rather than mapping it over
+    each element within the monad.
+
+    Arguments:
+    f -- a function from numbers to a number or bool
+
+    Example:
+    @kernel
+    def is_square(n):
+        r = int(n ** 0.5)
+        return r * r == n
+    """
+    return numba.vectorize(cache=True)(f)
+
+def monadic_numba(instance):
+    """
+    Decorates a monadic function so that invocation runs the monad,
+    backing ListMonad with NumPy arrays so that `kernel` functions apply
+    to each branch as a whole.
+
+    For ListMonad, the computation runs in NumpyListMonad and the
+    resulting array is converted back into a list, with NumPy scalars
+    converted into plain values, including within lifted tuples and
+    lists. Other monads run
+    as usual. In both cases, the generator is lowered into a state
+    machine where possible.
+
+    Arguments:
+    instance -- the monad instance to specialize for
+
+    Example:
+    @monadic_numba(ListMonad)
+    def squares_below(n):
+        x = yield filter_np(is_square, numpy.arange(n))
+        yield lift(x)
+    """
+    if instance is not ListMonad:
+        return monadic_sm(instance)
+    def wrap(f):
+        run = monadic_sm(NumpyListMonad)(f)
+        def monadic_context(*args, **kwargs):
+            return [_plain(x) for x in run(*args, **kwargs).tolist()]
+        return monadic_context
+    return wrap
+
+def _plain(value):
+    # `tolist` only converts the array's own elements, not those within them.
+    if isinstance(value, numpy.generic):
+        return value.item()
+    elif type(value) is tuple:
+        return tuple(_plain(item) for item in value)
+    elif type(value) is list:
+        return [_plain(item) for item in value]
+    return value
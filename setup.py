@@ -1,4 +1,15 @@
-from setuptools import setup
+from setuptools import setup, Extension
+
+# The list monad's runner is compiled with Cython when it's installed,
+# and otherwise runs as plain Python.
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize(
+        [Extension('guac._core', ['guac/_core.py'], extra_compile_args=['-O3', '-march=native'])],
+        compiler_directives={'language_level': 3})
 
 setup(name='guac',
     version='1.0.0',
@@ -7,12 +18,16 @@ setup(name='guac',
     author='Jaden Geller',
     license='MIT',
     packages=['guac'],
+    python_requires='>=3.8',
+    ext_modules=ext_modules,
+    extras_require={'numpy': ['numpy'], 'numba': ['numpy', 'numba']},
     classifiers=['Intended Audience :: Developers',
                  'Intended Audience :: Education',
                  'Topic :: Software Development :: Libraries',
                  'License :: OSI Approved :: MIT License',
                  'Programming Language :: Python :: 3 :: Only',
+                 'Programming Language :: Python :: Implementation :: CPython',
                  'Programming Language :: Python :: Implementation :: PyPy'
                  ],
     keywords='monad monadic coroutine generator pypy backtracking',
-    zip_safe=True)
+    zip_safe=not ext_modules)
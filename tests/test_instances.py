@@ -0,0 +1,96 @@
+import unittest
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from guac import *
+
+def pairs(n):
+    x = yield range(n)
+    y = yield range(x)
+    yield lift((x, y))
+
+def mixed_results():
+    x = yield [0, 1, 2]
+    if x == 0:
+        yield lift(1)
+    elif x == 1:
+        yield lift('a')
+    else:
+        yield lift(True)
+
+def odd_squares(n):
+    xs = yield lift(numpy.arange(n))
+    x = yield filter_np(lambda a: a % 2 == 1, map_np(lambda a: a * a, xs))
+    yield lift(x)
+
+def get_state(state):
+    return (state, state)
+
+def put_state(state):
+    return lambda _: (None, state)
+
+def counts(n):
+    for i in range(n):
+        state = yield get_state
+        yield put_state(state + 1)
+    yield lift('done')
+
+def reads(scale):
+    a = yield lambda env: env['a']
+    b = yield lambda env: env['b']
+    yield lift(scale * a * b)
+
+def parses(text):
+    n = yield int(text) if text.isdigit() else ValueError(text)
+    nothing = yield None
+    yield lift((n, nothing))
+
+class TestFailableMonads(unittest.TestCase):
+
+    def test_none_monad_concat_keeps_falsy_values(self):
+        self.assertEqual(concat(0, 5, monad=NoneMonad), 0)
+        self.assertEqual(concat(None, 5, monad=NoneMonad), 5)
+        self.assertIsNone(concat(None, None, monad=NoneMonad))
+
+    def test_exception_monad_short_circuits(self):
+        self.assertEqual(monadic(ExceptionMonad)(parses)('12'), (12, None))
+        error = monadic(ExceptionMonad)(parses)('x')
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(error.args, ('x',))
+
+class TestThreadedMonads(unittest.TestCase):
+
+    def test_state_monad_runs_long_computations(self):
+        self.assertEqual(monadic(StateMonad)(counts)(20000)(0), ('done', 20000))
+
+    def test_state_monad_reruns(self):
+        run = monadic(StateMonad)(counts)(3)
+        self.assertEqual(run(0), ('done', 3))
+        self.assertEqual(run(10), ('done', 13))
+
+    def test_function_monad(self):
+        run = monadic(FunctionMonad)(reads)(2)
+        self.assertEqual(run({'a': 3, 'b': 4}), 24)
+        self.assertEqual(run({'a': 1, 'b': 5}), 10)
+
+@unittest.skipUnless(numpy, 'requires NumPy')
+class TestNumpyListMonad(unittest.TestCase):
+
+    def test_matches_list_monad(self):
+        self.assertEqual(monadic(NumpyListMonad)(pairs)(4).tolist(),
+                         monadic(ListMonad)(pairs)(4))
+
+    def test_mixed_results_keep_their_types(self):
+        results = monadic(NumpyListMonad)(mixed_results)().tolist()
+        self.assertEqual(results, [1, 'a', True])
+        self.assertEqual([type(x) for x in results], [int, str, bool])
+        concatenated = NumpyListMonad.concat(NumpyListMonad.lift(1), NumpyListMonad.lift(2.5))
+        self.assertEqual(concatenated.tolist(), [1, 2.5])
+        self.assertIs(type(concatenated.tolist()[0]), int)
+
+    def test_vectorized_helpers(self):
+        self.assertEqual(monadic(NumpyListMonad)(odd_squares)(6).tolist(), [1, 9, 25])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import threading, unittest
+from guac import *
+from guac._lowering import LoweringError, lower
+
+# Each monadic function here is run both as a generator and as a lowered
+# state machine, which must agree.
+
+def branches(n):
+    x = yield range(n)
+    if x % 2:
+        y = yield [x, -x]
+    else:
+        y = x * 10
+    yield lift((x, y))
+
+def returns_early(n):
+    x = yield range(n)
+    if x == 1:
+        return
+    yield lift(x)
+
+def returns_from_branch(n):
+    x = yield range(n)
+    if x > 1:
+        yield lift(x)
+        return
+    y = yield [x, x]
+    yield lift(x + y)
+
+def defaults(a, b=2, *rest, c, d=4, **options):
+    x = yield [a, b]
+    yield lift((x, rest, c, d, sorted(options)))
+
+def unpacks(pairs):
+    (a, b) = yield pairs
+    [c, *d] = yield [(a, b, b), (b, a)]
+    yield lift((a, b, c, tuple(d)))
+
+def comprehends(n):
+    x = yield range(1, n)
+    squares = [i * i for i in range(x)]
+    total = sum(s for s in squares if s % 2)
+    yield guard(total > 0)
+    yield lift((x, squares, total))
+
+def helpers(n):
+    x = yield range(n)
+    y = yield map(lambda k: k + x, [x, n])
+    z = yield filter(lambda k: k != y, [x, y])
+    yield lift((x, y, z))
+
+def bare_yields(n):
+    x = yield range(n)
+    yield guard(x != 2)
+    yield [None, None]
+    yield lift(x)
+
+def maybe_halve(n):
+    half = yield n // 2 if n % 2 == 0 else None
+    yield guard(half >= 0)
+    yield lift(half)
+
+def stateful():
+    x = yield get_state()
+    yield put_state(x + 1)
+    if x > 10:
+        return
+    y = yield get_state()
+    yield lift(x * y)
+
+def accumulates():
+    seen = []
+    shared = {'seen': seen}
+    x = yield [1, 2, 3]
+    seen.append(x)
+    y = yield [10, 20]
+    shared['seen'].append(y)
+    yield lift(tuple(seen))
+
+def captures_local():
+    get = lambda: x
+    x = yield [1, 2, 3]
+    yield lift(get())
+
+def holds_lock():
+    lock = threading.Lock()
+    x = yield [1, 2]
+    yield lift((x, lock.locked()))
+
+def get_state():
+    return lambda state: (state, state)
+
+def put_state(state):
+    return lambda _: (None, state)
+
+def yields_in_loop(n):
+    total = 0
+    for i in range(n):
+        total += yield [i, -i]
+    yield lift(total)
+
+def yields_in_try(n):
+    try:
+        x = yield range(n)
+    except ValueError:
+        x = None
+    yield lift(x)
+
+def defines_function(n):
+    def double(k):
+        return k * 2
+    x = yield range(n)
+    yield lift(double(x))
+
+def closure(n):
+    def inner():
+        x = yield range(n)
+        yield lift(x)
+    return inner
+
+class TestLowering(unittest.TestCase):
+
+    def assertRunsAlike(self, monad, f, *args, **kwargs):
+        expected = monadic(monad)(f)(*args, **kwargs)
+        self.assertEqual(monadic_sm(monad)(f)(*args, **kwargs), expected)
+        return expected
+
+    def test_lowers(self):
+        for f in (branches, returns_early, returns_from_branch, defaults, unpacks,
+                  comprehends, helpers, bare_yields, maybe_halve, stateful, accumulates,
+                  captures_local, holds_lock):
+            self.assertIsInstance(lower(f), type)
+
+    def test_if_else_join(self):
+        self.assertEqual(self.assertRunsAlike(ListMonad, branches, 4),
+                         [(0, 0), (1, 1), (1, -1), (2, 20), (3, 3), (3, -3)])
+
+    def test_early_return(self):
+        self.assertRunsAlike(ListMonad, returns_early, 3)
+        self.assertRunsAlike(ListMonad, returns_from_branch, 4)
+
+    def test_defaults_and_keyword_only(self):
+        self.assertRunsAlike(ListMonad, defaults, 1, c=3)
+        self.assertRunsAlike(ListMonad, defaults, 1, 5, 6, 7, c=3, d=8, e=9)
+
+    def test_tuple_unpacking(self):
+        self.assertRunsAlike(ListMonad, unpacks, [(1, 2), (3, 4)])
+
+    def test_comprehensions(self):
+        self.assertRunsAlike(ListMonad, comprehends, 5)
+
+    def test_helpers(self):
+        self.assertRunsAlike(ListMonad, helpers, 3)
+        self.assertRunsAlike(ListMonad, bare_yields, 4)
+
+    def test_branches_from_copied_machine(self):
+        self.assertTrue(lower(accumulates)._sm_forkable)
+        self.assertFalse(lower(captures_local)._sm_forkable)
+        self.assertEqual(self.assertRunsAlike(ListMonad, accumulates),
+                         [(x, y) for x in (1, 2, 3) for y in (10, 20)])
+        self.assertEqual(self.assertRunsAlike(ListMonad, captures_local), [1, 2, 3])
+        self.assertEqual(self.assertRunsAlike(ListMonad, holds_lock), [(1, False), (2, False)])
+
+    def test_other_monads(self):
+        for n in (2, 3):
+            self.assertRunsAlike(NoneMonad, maybe_halve, n)
+        for state in (3, 11):
+            self.assertEqual(monadic_sm(StateMonad)(stateful)()(state),
+                             monadic(StateMonad)(stateful)()(state))
+
+    def test_fallback(self):
+        for f in (yields_in_loop, yields_in_try, defines_function, closure(3)):
+            with self.assertRaises(LoweringError):
+                lower(f)
+        self.assertRunsAlike(ListMonad, yields_in_loop, 3)
+        self.assertRunsAlike(ListMonad, yields_in_try, 3)
+        self.assertRunsAlike(ListMonad, defines_function, 3)
+        self.assertRunsAlike(ListMonad, closure(3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from guac import *
+from guac.monad import _generator_terminal, _memo
+
+class GenericListMonad(ListMonad):
+    # Overriding `bind` makes ListMonad fall back to the generic runner.
+    @staticmethod
+    def bind(m, f):
+        return [y for x in m for y in f(x)]
+
+def mutates_sent_value():
+    row = yield [[1], [2]]
+    row.append(9)
+    y = yield ['a', 'b', 'c']
+    yield lift((list(row), y))
+
+def mutates_yielded_value():
+    xs = [1, 2]
+    x = yield xs
+    xs.append(x + 10)
+    yield lift(x)
+
+class TestBranching(unittest.TestCase):
+
+    def assertBranches(self, f, expected):
+        for monad in (ListMonad, GenericListMonad):
+            for decorate in (monadic, monadic_sm):
+                self.assertEqual(decorate(monad)(f)(), expected)
+
+    def test_mutated_sent_values_stay_in_branch(self):
+        self.assertBranches(mutates_sent_value,
+                            [([x, 9], y) for x in (1, 2) for y in 'abc'])
+
+    def test_mutated_yielded_values_keep_their_branches(self):
+        self.assertBranches(mutates_yielded_value, [1, 2])
+
+calls = []
+
+@monadic(ListMonad)
+@memoized
+def fib(n):
+    calls.append(n)
+    if n < 2:
+        yield lift(n)
+    else:
+        x = yield fib(n - 1)
+        y = yield fib(n - 2)
+        yield lift(x + y)
+
+@monadic(ListMonad)
+@memoized
+def total(xs):
+    calls.append(xs)
+    yield lift(sum(xs))
+
+class TestMemoized(unittest.TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_runs_each_subcomputation_once(self):
+        self.assertEqual(fib(30), [832040])
+        self.assertEqual(sorted(calls), list(range(31)))
+
+    def test_table_lives_for_one_outermost_run(self):
+        fib(5)
+        self.assertFalse(hasattr(_memo, 'table'))
+        fib(5)
+        self.assertEqual(len(calls), 12)
+
+    def test_unhashable_arguments_run_unmemoized(self):
+        self.assertEqual(total([1, 2, 3]), [6])
+        self.assertEqual(total([1, 2, 3]), [6])
+        self.assertEqual(calls, [[1, 2, 3], [1, 2, 3]])
+
+class TestTerminalYields(unittest.TestCase):
+
+    def test_final_yield_is_terminal(self):
+        def f():
+            x = yield [1, 2]
+            yield lift(x, monad=ListMonad)
+        invocation = f()
+        next(invocation)
+        self.assertFalse(_generator_terminal(invocation))
+        invocation.send(1)
+        self.assertTrue(_generator_terminal(invocation))
+
+if __name__ == '__main__':
+    unittest.main()
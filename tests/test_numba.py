@@ -0,0 +1,39 @@
+import unittest
+try:
+    import numba, numpy
+except ImportError:
+    numba = None
+from guac import *
+
+if numba:
+    from guac.numba import kernel, monadic_numba
+
+    @kernel
+    def is_square(n):
+        r = int(n ** 0.5)
+        return r * r == n
+
+    @monadic_numba(ListMonad)
+    def squares_below(n):
+        x = yield filter_np(is_square, numpy.arange(n))
+        yield lift(x)
+
+    @monadic_numba(ListMonad)
+    def halves_of_squares(n):
+        x = yield filter_np(is_square, numpy.arange(n))
+        yield lift((x, x / 2))
+
+@unittest.skipUnless(numba, 'requires Numba')
+class TestNumba(unittest.TestCase):
+
+    def test_kernel_filters_whole_branch(self):
+        self.assertEqual(squares_below(50), [0, 1, 4, 9, 16, 25, 36, 49])
+        self.assertEqual({type(x) for x in squares_below(50)}, {int})
+
+    def test_lifted_tuples_hold_plain_values(self):
+        results = halves_of_squares(10)
+        self.assertEqual(results, [(0, 0.0), (1, 0.5), (4, 2.0), (9, 4.5)])
+        self.assertEqual({(type(x), type(y)) for (x, y) in results}, {(int, float)})
+
+if __name__ == '__main__':
+    unittest.main()